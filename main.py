@@ -1,18 +1,51 @@
-import json
+import asyncio
+import contextlib
+import functools
+import hashlib
+import importlib
+import importlib.util
+import io
 import os
+import httpx
+import numpy as np
+import orjson
 import requests
-import math
+import multiprocessing
+import random
+import sqlite3
+import sys
+import threading
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from typing import List, Dict, Any
-from fastapi import FastAPI
-from pydantic import BaseModel, model_validator
+from aiolimiter import AsyncLimiter
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, PrivateAttr, model_validator
+from pydantic.dataclasses import dataclass as pydantic_dataclass
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# 🔹 OR-Tools는 배차 작업자 프로세스에서만 쓰므로 서버 프로세스 시작 시에는 import하지 않고
+#    설치 여부만 확인 (실제 import는 배차 함수 안에서, 작업자 시작 시 미리 로드)
+if importlib.util.find_spec("ortools") is None:
+    print("❌ OR-Tools 설치 필요")
+
+# 🔹 numba는 선택 사항: 설치돼 있으면 하버사인 빈 칸 채우기를 JIT 커널로, 없으면 numpy 벡터 계산으로 처리
 try:
-    from ortools.constraint_solver import routing_enums_pb2
-    from ortools.constraint_solver import pywrapcp
+    from numba import njit
 except ImportError:
-    print("❌ OR-Tools 설치 필요")
+    njit = None
+
+# 🔹 uvloop도 선택 사항: 설치돼 있으면 상세 경로 일괄 조회 이벤트 루프를 libuv 기반으로 (Windows 미지원)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # ==========================================
 # 1. 설정 및 환경변수
@@ -22,9 +55,43 @@ LOADING_TIME = 30        # 적재 시간 30분
 WAREHOUSE_CLOSE_TIME = 1080  # 18:00 (오후 6:00, 물류센터 마감 시간 - 유조차 도착 마감, 이후 수송은 계속 가능)
 GASOLINE_UNLOADING_TIME = 40  # 휘발유 하역 시간
 DIESEL_UNLOADING_TIME = 30     # 등경유 하역 시간    
+INCLUDE_GEOMETRY = os.environ.get("INCLUDE_GEOMETRY") == "1"  # 상세 경로 좌표 응답 포함 여부 (기본 비활성화 - 응답 데이터 축소)
+SYMMETRIC_DURATIONS = os.environ.get("SYMMETRIC_DURATIONS") == "1"  # 매트릭스에 없는 구간을 API로 채울 때 A→B 값을 B→A에도 사용 (API 호출 절반)
+MATRIX_FILE = "jeju_distance_matrix_full.json"
+MATRIX_NPZ_FILE = "jeju_distance_matrix_full.npz"  # export_matrix_npz()로 만든 변환본 (있으면 JSON 대신 사용)
+PATH_CACHE_DB = os.environ.get("PATH_CACHE_DB", "path_cache.db")  # 상세 경로 캐시 저장 파일 (빈 값이면 메모리 캐시만 사용)
+PATH_CACHE_MAX_SIZE = 4096     # 상세 경로 캐시 최대 개수
+DRIVING_TIME_CACHE_MAX_SIZE = 100_000  # 네이버 API 소요시간 캐시 최대 개수
+GEOMETRY_BATCH_TIMEOUT = 10    # 상세 경로 일괄 조회 전체 대기 한도(초), 초과한 구간은 빈 경로
+GEOMETRY_MAX_CONCURRENCY = 8   # 상세 경로 API 동시 요청 수 상한 (HTTP/2는 연결 하나에 요청을 무제한 다중화하므로 별도로 제한)
+GEOMETRY_RATE_LIMIT = 10       # 상세 경로 API 초당 호출 수 상한 (서버 전체, 배차 작업자 프로세스마다 SOLVE_WORKERS로 나눠 적용)
+GEOMETRY_429_RETRIES = 2       # 상세 경로 API가 429(호출량 초과)를 반환할 때 재시도 횟수
+SOLVE_TIME_LIMIT = 10          # OR-Tools 1회 탐색 시간(초)
+SMALL_SOLVE_TIME_LIMIT = 3     # 주문 수가 적을 때 탐색 시간(초)
+SMALL_SOLVE_MAX_ORDERS = 30    # 이 개수 미만이면 SMALL_SOLVE_TIME_LIMIT 적용
+SOLVE_WORKERS = int(os.environ.get("SOLVE_WORKERS", "0")) or max(2, min(4, os.cpu_count() or 2))  # 배차 작업자 프로세스 수
+SMALL_SOLVE_SOLUTION_LIMIT = 1000  # 주문 수가 적을 때 이 개수만큼 해를 찾으면 시간 제한 전이라도 탐색 종료
+ALTTEUL_PREFERRED_VEHICLE = "제주96바7408"  # 알뜰 주유소 휘발유 주문을 먼저 처리하는 차량
+# 🔹 유종 구분은 내부에서 정수로 처리 (요청/응답의 한글 유종명은 FUEL_NAMES로 변환)
+FUEL_GAS, FUEL_DIESEL = 0, 1
+FUEL_NAMES = ("휘발유", "등경유")
+DEBUG = os.environ.get("VRP_DEBUG") == "1"  # 배차 과정 debug_logs 기록 여부 (기본 비활성화 - 문자열 생성/응답 크기 축소)
+
+# 하루 중 분(0~1439) → "HH:MM" 문자열 표 (응답 생성 시 매번 포맷하지 않도록 미리 계산)
+_MINUTE_TO_HHMM = tuple(f"{m // 60:02d}:{m % 60:02d}" for m in range(1440))
+
+def format_minutes(t):
+    return _MINUTE_TO_HHMM[t] if 0 <= t < 1440 else f"{t // 60:02d}:{t % 60:02d}"
 
 # [디버깅용] 현재 로드된 환경변수 키 목록 출력 (값은 보안상 출력 안함)
-print("🔍 현재 서버 환경변수 목록:", list(os.environ.keys()))
+# 🔹 배차 작업자 프로세스도 모듈을 다시 import하므로 VRP_DEBUG=1일 때만 출력
+if DEBUG:
+    print("🔍 현재 서버 환경변수 목록:", list(os.environ.keys()))
+
+# 같은 경고는 프로세스당 한 번만 출력 (배차 요청마다 stdout에 반복해서 쓰지 않도록)
+@functools.cache
+def warn_once(message):
+    print(message)
 
 # 환경변수 읽기 (유연한 처리)
 NAVER_ID = os.environ.get("NAVER_CLIENT_ID") or os.environ.get("x-ncp-apigw-api-key-id")
@@ -36,10 +103,35 @@ else:
     masked_id = NAVER_ID[:2] + "*" * 5 if NAVER_ID else "None"
     print(f"✅ 네이버 지도 API 키 로드 성공 (ID: {masked_id})")
 
+# HTTP 호출용 세션 (HTTP keep-alive로 매 호출마다 TCP/TLS 핸드셰이크 반복 방지)
+# 🔹 일시적인 429/5xx 응답은 짧게 재시도 (Retry-After는 따르지 않음 → 배차 중 대기 시간이 길어지지 않도록)
+NAVER_DIRECTION_URL = "https://maps.apigw.ntruss.com/map-direction/v1/driving"
+_SESSION = requests.Session()
+_retry_adapter = HTTPAdapter(
+    pool_connections=8, pool_maxsize=16,
+    max_retries=Retry(
+        total=2, backoff_factor=0.1, status_forcelist=(429, 502, 503, 504), respect_retry_after_header=False
+    )
+)
+_SESSION.mount("https://", _retry_adapter)
+_SESSION.mount("http://", _retry_adapter)
+# 매트릭스 URL 다운로드에도 같은 세션을 쓰므로 API 키 헤더는 세션 기본값이 아닌 네이버 호출에만 넣음
+NAVER_HEADERS = {
+    "X-NCP-APIGW-API-KEY-ID": NAVER_ID,
+    "X-NCP-APIGW-API-KEY": NAVER_SECRET
+} if NAVER_ID and NAVER_SECRET else {}
+
 # ==========================================
 # 2. 데이터 모델
 # ==========================================
-class OrderItem(BaseModel):
+ORDER_WRAPPER_KEYS = ('주문량', 'order', 'data')  # 주문 수량을 감싸서 보내는 경우의 키
+ORDER_AMOUNT_KEYS = ('휘발유', '경유', '등유')
+ORDER_INT_FIELDS = ('휘발유', '등유', '경유', 'start_min', 'end_min', 'priority')  # 문자열/빈 값도 정수로 변환
+
+# 🔹 주문은 요청마다 수백 개 생성되고 배차 프로세스로 pickle 전달되므로 __slots__ 기반 pydantic dataclass 사용
+#    (정의되지 않은 추가 키는 어디서도 읽지 않으므로 보관하지 않고 무시)
+@pydantic_dataclass(slots=True, config=ConfigDict(extra='ignore'))
+class OrderItem:
     주유소명: str
     브랜드: str = ""  # "SK" 또는 "알뜰"
     휘발유: int = 0
@@ -48,40 +140,46 @@ class OrderItem(BaseModel):
     start_min: int = 420  # 7:00 (기본 방문 시작 시간)
     end_min: int = 1435  # 23:55 (기본 방문 종료 시간)
     priority: int = 2
-    
-    class Config:
-        extra = 'allow'
 
     @model_validator(mode='before')
     @classmethod
     def flatten_data(cls, data: Any) -> Any:
         if isinstance(data, dict):
-            for key in ['주문량', 'order', 'data']:
-                if key in data and isinstance(data[key], dict):
-                    inner = data[key]
-                    if any(k in inner for k in ['휘발유', '경유', '등유']):
-                        data.update(inner)
-            for field in ['휘발유', '등유', '경유', 'start_min', 'end_min', 'priority']:
-                if field in data:
-                    try:
-                        if data[field] == "" or data[field] is None:
-                            data[field] = 0
-                        else:
-                            data[field] = int(data[field])
-                    except:
-                        data[field] = 0
+            # 🔹 주유소명은 거리 캐시 키로 반복 해시되므로 intern (로드 시 intern된 이름과 동일 객체)
+            if isinstance(data.get('주유소명'), str):
+                data['주유소명'] = sys.intern(data['주유소명'])
+            for key in ORDER_WRAPPER_KEYS:
+                inner = data.get(key)
+                if isinstance(inner, dict) and any(k in inner for k in ORDER_AMOUNT_KEYS):
+                    data.update(inner)
+            for field in ORDER_INT_FIELDS:
+                if field not in data:
+                    continue
+                value = data[field]
+                # 🔹 대부분의 요청은 이미 정수이므로 변환/예외 처리 없이 통과
+                if type(value) is int:
+                    continue
+                try:
+                    data[field] = 0 if value == "" or value is None else int(value)
+                except:
+                    data[field] = 0
             # 🔹 알뜰 주유소 휘발유 150드럼(150L 단위 기준) 이상 주문은 자동으로 우선순위 1로 설정
-            try:
-                brand = data.get('브랜드', '')
-                gasoline = int(data.get('휘발유', 0) or 0)
-                if brand == '알뜰' and gasoline >= 150:
-                    # 사용자가 이미 priority=1을 명시했다면 그대로 유지, 그 외에는 1로 강제
-                    data['priority'] = 1
-            except Exception:
-                # 변환 오류 시에는 우선순위 규칙만 건너뜀
-                pass
+            #    (사용자가 이미 priority=1을 명시했다면 그대로 유지, 그 외에는 1로 강제)
+            if data.get('브랜드') == '알뜰' and data.get('휘발유', 0) >= 150:
+                data['priority'] = 1
         return data
 
+# 🔹 주문 수치 속성 배열의 열 순서 (요청 수신 시 한 번만 만들어 배차 단계에서 pydantic 속성 접근 없이 재사용)
+COL_GAS, COL_KEROSENE, COL_DIESEL, COL_START, COL_END, COL_PRIORITY = range(6)
+
+def build_order_array(orders):
+    """
+    주문 목록 → (휘발유, 등유, 경유, start_min, end_min, priority) int64 배열
+    """
+    return np.array(
+        [(o.휘발유, o.등유, o.경유, o.start_min, o.end_min, o.priority) for o in orders], dtype=np.int64
+    ).reshape(len(orders), 6)
+
 class VehicleItem(BaseModel):
     차량번호: str
     유종: str
@@ -91,37 +189,150 @@ class OptimizationRequest(BaseModel):
     orders: List[OrderItem]
     vehicles: List[VehicleItem]
 
+    # 🔹 요청 수신 시 주문 수치를 배열로 만들고 유종/브랜드별로 한 번만 분류 (유종별 배차마다 전체 주문을 다시 훑지 않도록)
+    _order_arr: Any = PrivateAttr(default=None)           # build_order_array(orders)
+    _sk_idx: Any = PrivateAttr(default=None)              # 휘발유 주문 (알뜰 제외) 위치
+    _altteul_idx: Any = PrivateAttr(default=None)         # 알뜰 주유소 휘발유 주문 (7408 우선) 위치
+    _diesel_idx: Any = PrivateAttr(default=None)          # 등유/경유 주문 위치
+    _excluded_names: Dict[int, List[str]] = PrivateAttr(default_factory=dict)  # 유종별 주문량 0 주유소명
+    _vehicles: Dict[int, List[VehicleItem]] = PrivateAttr(default_factory=dict)  # 유종별 차량
+
+    @model_validator(mode='after')
+    def bin_orders(self):
+        arr = build_order_array(self.orders)
+        is_altteul = np.fromiter((o.브랜드 == '알뜰' for o in self.orders), dtype=bool, count=len(self.orders))
+        has_gas = arr[:, COL_GAS] > 0
+        has_dk = arr[:, COL_KEROSENE] + arr[:, COL_DIESEL] > 0
+        self._order_arr = arr
+        self._sk_idx = np.flatnonzero(has_gas & ~is_altteul)
+        self._altteul_idx = np.flatnonzero(has_gas & is_altteul)
+        self._diesel_idx = np.flatnonzero(has_dk)
+        # 휘발유 모드에서 등/경유만 있는 주문은 디젤 단계에서 처리하므로 제외하지 않음
+        self._excluded_names = {
+            FUEL_GAS: [self.orders[i].주유소명 for i in np.flatnonzero(~has_gas & ~has_dk)],
+            FUEL_DIESEL: [self.orders[i].주유소명 for i in np.flatnonzero(~has_dk)],
+        }
+        # 🔹 차량도 유종별로 한 번만 분류 (배차 프로세스에는 해당 유종 차량만 전달)
+        self._vehicles = {
+            fuel_type: [v for v in self.vehicles if v.유종 == fuel_name] for fuel_type, fuel_name in enumerate(FUEL_NAMES)
+        }
+        return self
+
+    def orders_for(self, fuel_type):
+        """
+        유종별 (일반 주문, 알뜰 우선 주문, 제외된 주유소명, 일반+알뜰 순서의 주문 배열) 반환
+        """
+        if fuel_type == FUEL_GAS:
+            idx, altteul_idx = self._sk_idx, self._altteul_idx
+        else:
+            idx, altteul_idx = self._diesel_idx, self._altteul_idx[:0]
+        return (
+            [self.orders[i] for i in idx],
+            [self.orders[i] for i in altteul_idx],
+            self._excluded_names[fuel_type],
+            self._order_arr[np.concatenate([idx, altteul_idx])],
+        )
+
+    def vehicles_for(self, fuel_type):
+        """
+        유종별 차량 목록 반환 (유종이 휘발유/등경유가 아닌 차량은 어느 쪽에도 포함되지 않음)
+        """
+        return self._vehicles[fuel_type]
+
+# 🔹 응답 경로의 방문 지점 1개 (지점마다 dict를 만들지 않고 __slots__ 객체로 보관, orjson이 dict 형태로 직렬화)
+@dataclass(slots=True)
+class Waypoint:
+    location: str
+    lat: float
+    lon: float
+    time: int
+    load: int
+
 # ==========================================
 # 3. 데이터 로드 (속도 최적화)
 # ==========================================
-NODE_INFO = {}
-MATRIX_DATA = {} # 거리 데이터 캐시
-DIST_CACHE = {}
-PATH_CACHE = {}
+NODE_COORDS = {}  # 주유소명 → (lat, lon)
+NAME_TO_IDX = {}  # 주유소명 → MATRIX_NP 행/열 번호 (이름은 요청 입출력에서만 사용, 내부 조회는 정수 번호)
+MATRIX_NP = np.zeros((0, 0), dtype=np.int32)  # 소요시간(분) 매트릭스, 데이터 없는 칸은 -1
+DRIVING_TIME_CACHE = {}  # 매트릭스에 없는 구간의 네이버 API 소요시간(분) 캐시 (성공한 호출만 저장)
+_DRIVING_TIME_LOCK = threading.Lock()
+PATH_CACHE = {}  # 상세 경로 캐시 (PATH_CACHE_MAX_SIZE 초과 시 오래된 것부터 제거)
+_PATH_CACHE_LOCK = threading.Lock()  # 같은 프로세스의 여러 스레드가 동시에 제거/추가할 때 같은 키를 두 번 제거하지 않도록
+# 🔹 구간 좌표는 [경도, 위도] 행의 float64 (n, 2) 배열로 보관 (중첩 리스트보다 메모리/프로세스 간 pickle 전달이 가볍고,
+#    응답은 orjson이 배열을 그대로 [[경도, 위도], ...]로 직렬화)
+NO_PATH = np.zeros((0, 2))  # 좌표가 없거나 조회에 실패한 구간의 빈 경로 (0, 2)
+
+def export_matrix_npz(json_path=MATRIX_FILE, npz_path=MATRIX_NPZ_FILE):
+    """
+    JSON 매트릭스 파일 → .npz 변환본 저장 (JSON 파싱/매트릭스 변환 없이 배열 그대로 로드 가능)
+    사용: python -c "import main; main.export_matrix_npz()"
+    """
+    with open(json_path, "rb") as f:
+        raw_data = orjson.loads(f.read())
+    if isinstance(raw_data, list) and len(raw_data) > 0:
+        raw_data = raw_data[0]
+    nodes = raw_data.get("node_info", [])
+    name_to_idx, minutes = build_matrix_np(raw_data.get("matrix", {}))
+    np.savez_compressed(
+        npz_path,
+        node_names=np.array([node["name"] for node in nodes], dtype=str),
+        node_coords=np.array([(node["lat"], node["lon"]) for node in nodes], dtype=np.float64).reshape(len(nodes), 2),
+        names=np.array(list(name_to_idx), dtype=str),
+        minutes=minutes,
+    )
+
+def _load_npz(source):
+    """
+    export_matrix_npz로 만든 .npz (파일 경로 또는 파일 객체) → (좌표 dict, 주유소명 → 번호, 소요시간 매트릭스)
+    """
+    with np.load(source) as data:
+        coords = {
+            sys.intern(name): (lat, lon)
+            for name, (lat, lon) in zip(data["node_names"].tolist(), data["node_coords"].tolist())
+        }
+        name_to_idx = {sys.intern(name): i for i, name in enumerate(data["names"].tolist())}
+        return coords, name_to_idx, data["minutes"].astype(np.int32)
 
 def load_data():
-    global NODE_INFO, MATRIX_DATA
+    global NODE_COORDS, NAME_TO_IDX, MATRIX_NP
     raw_data = None
+    npz_source = None
     url = os.environ.get("JEJU_MATRIX_URL")
     
-    # 1. URL 다운로드 시도
+    # 1. URL 다운로드 시도 (주소가 .npz면 변환본으로 로드)
     if url:
         try:
             print(f"🌐 URL 데이터 다운로드 시도...")
-            res = requests.get(url, timeout=15)
+            res = _SESSION.get(url, timeout=15)
             if res.status_code == 200: 
-                raw_data = res.json()
+                if urllib.parse.urlsplit(url).path.endswith(".npz"):
+                    npz_source = io.BytesIO(res.content)
+                else:
+                    raw_data = orjson.loads(res.content)
                 print("✅ URL에서 매트릭스 데이터 로드 성공!")
             else: 
                 print(f"❌ URL 로드 실패: {res.status_code}")
         except Exception as e:
             print(f"❌ URL 에러: {e}")
     
-    # 2. 파일 로드 (URL 실패 시 백업)
-    if not raw_data and os.path.exists("jeju_distance_matrix_full.json"):
+    # 2. 파일 로드 (URL 실패 시 백업): .npz 변환본이 있으면 JSON보다 먼저 사용
+    if not raw_data and npz_source is None and os.path.exists(MATRIX_NPZ_FILE):
+        npz_source = MATRIX_NPZ_FILE
+    if npz_source is not None:
         try:
-            with open("jeju_distance_matrix_full.json", "r", encoding="utf-8") as f:
-                raw_data = json.load(f)
+            coords, NAME_TO_IDX, MATRIX_NP = _load_npz(npz_source)
+        except Exception as e:
+            print(f"❌ .npz 로드 실패, JSON으로 대체: {e}")
+        else:
+            NODE_COORDS.update(coords)
+            print(f"✅ 매트릭스 변환본(.npz) 로드 완료: 좌표 {len(NODE_COORDS)}개, 매트릭스 {len(NAME_TO_IDX)}개 지점")
+            complete_matrix()
+            return
+
+    if not raw_data and os.path.exists(MATRIX_FILE):
+        try:
+            with open(MATRIX_FILE, "rb") as f:
+                raw_data = orjson.loads(f.read())
             print("📂 로컬 파일에서 데이터 로드 성공!")
         except: pass
 
@@ -133,165 +344,461 @@ def load_data():
         # 좌표 정보 로드
         if "node_info" in raw_data:
             for node in raw_data["node_info"]:
-                NODE_INFO[node["name"]] = {"lat": node["lat"], "lon": node["lon"]}
-            print(f"✅ 좌표 데이터 준비 완료: {len(NODE_INFO)}개 지점")
+                NODE_COORDS[sys.intern(node["name"])] = (node["lat"], node["lon"])
+            print(f"✅ 좌표 데이터 준비 완료: {len(NODE_COORDS)}개 지점")
             
         # 거리 매트릭스 로드 (핵심!)
         if "matrix" in raw_data:
-            MATRIX_DATA = raw_data["matrix"]
-            print(f"✅ 거리 매트릭스 준비 완료: {len(MATRIX_DATA)}개 지점")
+            # 원본 dict는 배열로 변환한 뒤 보관하지 않음
+            NAME_TO_IDX, MATRIX_NP = build_matrix_np(raw_data["matrix"])
+            print(f"✅ 거리 매트릭스 준비 완료: {len(NAME_TO_IDX)}개 지점")
         else:
             print("⚠️ [주의] JSON에 'matrix' 키가 없습니다. API 호출로 대체합니다(느림).")
 
-load_data()
+        complete_matrix()
+
+def _to_km(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def build_matrix_np(matrix_data):
+    """
+    거리(km) 매트릭스 dict → 소요시간(분) int32 배열 (get_driving_time과 동일한 환산: 거리 * 1.5, 최소 5분)
+    요청마다 주유소명 dict를 N² 번 조회하지 않도록 로드 시 한 번만 변환
+    """
+    # 행 키 + (행에는 없고 열에만 있는) 주유소명까지 번호 부여
+    names = [sys.intern(name) for name in matrix_data]
+    name_to_idx = {name: i for i, name in enumerate(names)}
+    for row in matrix_data.values():
+        if row.keys() <= name_to_idx.keys():  # 대부분의 행은 새 이름 없음 (집합 비교는 C에서 처리)
+            continue
+        for other in row:
+            if other not in name_to_idx:
+                name_to_idx[sys.intern(other)] = len(names)
+                names.append(other)
+    dist = np.full((len(names), len(names)), np.nan)
+    keys, cols = None, None
+    for name, row in matrix_data.items():
+        i = name_to_idx[name]
+        # 행마다 열 순서가 같으면 열 번호 목록을 재사용
+        if keys is None or tuple(row) != keys:
+            keys = tuple(row)
+            cols = [name_to_idx[other] for other in keys]
+        # 🔹 칸마다 numpy 스칼라 대입을 하지 않고 행 단위로 한 번에 변환/대입
+        try:
+            dist[i, cols] = np.fromiter(row.values(), dtype=np.float64, count=len(cols))
+            continue
+        except (TypeError, ValueError):
+            pass
+        # 숫자가 아닌 값(null 등)이 섞인 행은 해당 칸만 빈 값(NaN)으로
+        dist[i, cols] = [_to_km(value) for value in row.values()]
+
+    known = np.isfinite(dist)
+    minutes = np.full(dist.shape, -1, dtype=np.int32)
+    minutes[known] = np.maximum(5, (dist[known] * 1.5).astype(np.int32))
+    minutes[known & (dist == 0)] = 0  # 같은 위치에 있는 지점
+    np.fill_diagonal(minutes, 0)
+    return name_to_idx, minutes
 
 # 거리/시간 계산 (최적화된 버전)
+# 🔹 매트릭스 값은 배열에서 바로 읽고, 매트릭스에 없는 구간은 API 성공 결과만 DRIVING_TIME_CACHE에 저장
+#    (API 실패 시의 하버사인/기본값은 캐시하지 않음 → 일시적 장애 후 다음 요청에서 API 재시도)
 def get_driving_time(start_name, end_name):
-    key = f"{start_name}->{end_name}"
-    if key in DIST_CACHE: return DIST_CACHE[key]
-    
+    # 같은 지점이면 이동 시간 없음 (매트릭스/API/하버사인 조회 불필요)
+    if start_name == end_name:
+        return 0
+
     # 1순위: 미리 로드된 매트릭스 파일 사용 (가장 빠름)
-    if start_name in MATRIX_DATA and end_name in MATRIX_DATA[start_name]:
-        try:
-            # 데이터가 km 단위라고 가정하고 시간(분)으로 변환
-            # 시속 40km/h 가정: 거리(km) * 1.5 = 소요시간(분)
-            dist_val = float(MATRIX_DATA[start_name][end_name])
-            minutes = int(dist_val * 1.5)
-            # 너무 짧으면 기본 5분
-            return max(5, minutes)
-        except:
-            pass
+    # 로드 시 km → 분 환산 완료 (시속 40km/h 가정: 거리(km) * 1.5, 최소 5분), 데이터 없는 칸은 -1
+    i = NAME_TO_IDX.get(start_name)
+    j = NAME_TO_IDX.get(end_name)
+    if i is not None and j is not None:
+        minutes = int(MATRIX_NP[i, j])
+        if minutes >= 0:
+            return minutes
+    minutes = DRIVING_TIME_CACHE.get((start_name, end_name))
+    if minutes is not None:
+        return minutes
+    return _get_driving_time_fallback(start_name, end_name)
 
+# 매트릭스에 없는 구간 (API 성공 결과만 DRIVING_TIME_CACHE에 저장)
+def _get_driving_time_fallback(start_name, end_name):
     # 2순위: 좌표가 없으면 기본값
-    if start_name not in NODE_INFO or end_name not in NODE_INFO: 
+    if start_name not in NODE_COORDS or end_name not in NODE_COORDS: 
         return 20
     
     # 3순위: 네이버 API (매트릭스 파일에 데이터가 없을 때만 호출)
     # (최적화 단계에서 API를 남발하면 타임아웃 되므로 가급적 파일 사용 권장)
     if NAVER_ID and NAVER_SECRET:
         try:
-            url = "https://maps.apigw.ntruss.com/map-direction/v1/driving"
-            headers = {
-                "X-NCP-APIGW-API-KEY-ID": NAVER_ID,
-                "X-NCP-APIGW-API-KEY": NAVER_SECRET
-            }
-            start = NODE_INFO[start_name]
-            goal = NODE_INFO[end_name]
+            lat1, lon1 = NODE_COORDS[start_name]
+            lat2, lon2 = NODE_COORDS[end_name]
             params = {
-                "start": f"{start['lon']},{start['lat']}",
-                "goal": f"{goal['lon']},{goal['lat']}",
+                "start": f"{lon1},{lat1}",
+                "goal": f"{lon2},{lat2}",
                 "option": "trafast"
             }
-            res = requests.get(url, headers=headers, params=params, timeout=3)
+            res = _SESSION.get(NAVER_DIRECTION_URL, params=params, headers=NAVER_HEADERS, timeout=3)
             if res.status_code == 200:
                 json_res = res.json()
                 if json_res["code"] == 0:
                     minutes = int(json_res["route"]["trafast"][0]["summary"]["duration"] / 60000)
-                    DIST_CACHE[key] = minutes
+                    with _DRIVING_TIME_LOCK:
+                        if len(DRIVING_TIME_CACHE) >= DRIVING_TIME_CACHE_MAX_SIZE:
+                            DRIVING_TIME_CACHE.pop(next(iter(DRIVING_TIME_CACHE)))
+                        DRIVING_TIME_CACHE[(start_name, end_name)] = minutes
                     return minutes
         except: pass
 
     # 4순위: 하버사인 백업
-    start = NODE_INFO[start_name]
-    goal = NODE_INFO[end_name]
+    lat1, lon1 = NODE_COORDS[start_name]
+    lat2, lon2 = NODE_COORDS[end_name]
+    if _haversine_minutes_nb is not None:
+        return _haversine_minutes_nb(float(lat1), float(lon1), float(lat2), float(lon2))
+    return int(haversine_minutes(lat1, lon1, lat2, lon2))
+
+def haversine_minutes(lat1, lon1, lat2, lon2):
+    """
+    직선(하버사인) 거리 기반 소요시간(분): 시속 40km/h, 우회 계수 1.3, 최소 5분
+    스칼라/배열 모두 가능 (배열이면 구간 여러 개를 한 번에 계산)
+    """
     R = 6371
-    dLat = math.radians(goal['lat'] - start['lat'])
-    dLon = math.radians(goal['lon'] - start['lon'])
-    a = math.sin(dLat/2)**2 + math.cos(math.radians(start['lat'])) * math.cos(math.radians(goal['lat'])) * math.sin(dLon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    dLat = np.radians(np.subtract(lat2, lat1))
+    dLon = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dLat/2)**2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dLon/2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
     dist_km = R * c
-    return max(5, int((dist_km / 40) * 60 * 1.3))
+    return np.maximum(5, ((dist_km / 40) * 60 * 1.3).astype(np.int64))
+
+if njit is not None:
+    @njit(cache=True)
+    def _haversine_minutes_nb(lat1, lon1, lat2, lon2):
+        """haversine_minutes의 스칼라 전용 JIT 버전 (구간 1개 조회 시 numpy 스칼라 연산 오버헤드 없음)"""
+        dLat = np.radians(lat2 - lat1)
+        dLon = np.radians(lon2 - lon1)
+        a = np.sin(dLat/2)**2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dLon/2)**2
+        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+        return max(5, int((6371 * c / 40) * 60 * 1.3))
+
+    @njit(cache=True)
+    def _fill_haversine_nb(durations, coords, has_coord):
+        """
+        durations의 빈 칸(-1)을 제자리에서 채움 (haversine_minutes와 같은 공식, 좌표 없는 지점이 끼면 20분)
+        numpy 경로와 달리 중간 배열을 만들지 않음
+        """
+        n = durations.shape[0]
+        for i in range(n):
+            for j in range(n):
+                if durations[i, j] >= 0:
+                    continue
+                if not (has_coord[i] and has_coord[j]):
+                    durations[i, j] = 20
+                    continue
+                durations[i, j] = _haversine_minutes_nb(coords[i, 0], coords[i, 1], coords[j, 0], coords[j, 1])
+else:
+    _haversine_minutes_nb = _fill_haversine_nb = None
+
+def build_duration_matrix(locs):
+    """
+    locs 순서의 N×N 소요시간(분) 배열. MATRIX_NP에서 한 번에 잘라오고,
+    매트릭스에 없는 칸(미등록 주유소 등)만 get_driving_time과 같은 기준(API → 하버사인)으로 채움
+    """
+    N = len(locs)
+    idx = np.fromiter((NAME_TO_IDX.get(name, -1) for name in locs), dtype=np.int64, count=N)
+    known = np.flatnonzero(idx >= 0)
+    durations = np.full((N, N), -1, dtype=np.int32)
+    durations[np.ix_(known, known)] = MATRIX_NP[np.ix_(idx[known], idx[known])]
+    np.fill_diagonal(durations, 0)
+    missing = durations < 0
+    if not missing.any():
+        return durations
+
+    if NAVER_ID and NAVER_SECRET:
+        # 네이버 API는 구간마다 호출 (성공 결과는 DRIVING_TIME_CACHE에 저장)
+        for i, j in zip(*np.nonzero(missing)):
+            if durations[i, j] >= 0:  # SYMMETRIC_DURATIONS로 이미 역방향 값을 받은 칸
+                continue
+            durations[i, j] = get_driving_time(locs[i], locs[j])
+            # 🔹 실제 도로 소요시간은 방향마다 다를 수 있으므로 설정한 경우에만, 역방향도 비어 있을 때만 채움
+            if SYMMETRIC_DURATIONS and durations[j, i] < 0:
+                durations[j, i] = durations[i, j]
+        return durations
+
+    # 🔹 API가 없으면 하버사인 백업만 쓰므로 빈 칸 전체를 한 번에 벡터 계산 (좌표 없는 지점이 끼면 기본 20분)
+    has_coord = np.fromiter((name in NODE_COORDS for name in locs), dtype=bool, count=N)
+    coords = np.array(
+        [NODE_COORDS.get(name, (0.0, 0.0)) for name in locs],
+        dtype=np.float64
+    ).reshape(N, 2)
+    if _fill_haversine_nb is not None:
+        _fill_haversine_nb(durations, coords, has_coord)
+        return durations
+    durations[missing] = 20
+    ii, jj = np.nonzero(missing & has_coord[:, None] & has_coord[None, :])
+    durations[ii, jj] = haversine_minutes(coords[ii, 0], coords[ii, 1], coords[jj, 0], coords[jj, 1])
+    return durations
+
+def sub_durations(durations, order_idx):
+    """
+    [물류센터] + 전체 주문 매트릭스에서 물류센터 + order_idx 주문의 행/열만 잘라냄
+    """
+    rows = np.concatenate(([0], np.asarray(order_idx) + 1))
+    return durations[np.ix_(rows, rows)]
 
 # 상세 경로 좌표 가져오기 (결과 생성 시에만 호출)
-def get_detailed_path_geometry(start_name, end_name):
-    key = f"{start_name}->{end_name}"
+async def _fetch_path(client, start_name, end_name, limiter=None):
+    key = (start_name, end_name)
     if key in PATH_CACHE: return PATH_CACHE[key]
-    if start_name not in NODE_INFO or end_name not in NODE_INFO: return []
-    if not NAVER_ID or not NAVER_SECRET: return []
+    if start_name not in NODE_COORDS or end_name not in NODE_COORDS: return NO_PATH
 
+    lat1, lon1 = NODE_COORDS[start_name]
+    lat2, lon2 = NODE_COORDS[end_name]
+    params = {
+        "start": f"{lon1},{lat1}",
+        "goal": f"{lon2},{lat2}",
+        "option": "trafast"
+    }
+    # 🔹 호출량 여유가 있으면 바로 요청하고, 초당 한도를 넘을 때만 대기 (토큰 버킷)
+    #    429를 받으면 지수 백오프 + 지터 후 재시도 (동시에 대기한 요청이 한꺼번에 다시 몰리지 않도록)
+    #    (예외 처리는 네트워크/응답 오류만: 리미터 설정 오류 등은 빈 경로로 숨기지 않음)
+    for attempt in range(GEOMETRY_429_RETRIES + 1):
+        async with limiter or contextlib.nullcontext():
+            try:
+                res = await client.get(NAVER_DIRECTION_URL, params=params, timeout=5)
+            except httpx.HTTPError:
+                return NO_PATH
+        if res.status_code != 429:
+            break
+        if attempt < GEOMETRY_429_RETRIES:
+            await asyncio.sleep(0.2 * 2 ** attempt * (1 + random.random()))
+    if res.status_code != 200:
+        return NO_PATH
     try:
-        start = NODE_INFO[start_name]
-        goal = NODE_INFO[end_name]
-        url = "https://maps.apigw.ntruss.com/map-direction/v1/driving"
-        headers = {
-            "X-NCP-APIGW-API-KEY-ID": NAVER_ID,
-            "X-NCP-APIGW-API-KEY": NAVER_SECRET
-        }
-        params = {
-            "start": f"{start['lon']},{start['lat']}",
-            "goal": f"{goal['lon']},{goal['lat']}",
-            "option": "trafast"
-        }
-        res = requests.get(url, headers=headers, params=params, timeout=5)
-        if res.status_code == 200:
-            json_res = res.json()
-            if json_res["code"] == 0:
-                path_data = json_res["route"]["trafast"][0]["path"]
-                PATH_CACHE[key] = path_data
-                return path_data
-    except: pass
-    return []
+        json_res = res.json()
+        if json_res["code"] != 0:
+            return NO_PATH
+        path_data = np.asarray(json_res["route"]["trafast"][0]["path"], dtype=np.float64).reshape(-1, 2)
+    except (ValueError, KeyError, IndexError, TypeError):
+        return NO_PATH
+    # 실패한 호출은 캐시하지 않음 → 다음 요청에서 재시도
+    with _PATH_CACHE_LOCK:
+        if len(PATH_CACHE) >= PATH_CACHE_MAX_SIZE:
+            PATH_CACHE.pop(next(iter(PATH_CACHE)))
+        PATH_CACHE[key] = path_data
+    return path_data
+
+# 🔹 상세 경로 캐시는 SQLite 파일에도 저장하여 재시작 후에도 이미 받은 구간은 API를 다시 호출하지 않음
+#    (프로세스마다 첫 경로 조회 시 한 번 열고, 최근 저장된 구간부터 PATH_CACHE 크기만큼 메모리로 읽어옴)
+_PATH_DB = None
+_PATH_DB_LOCK = threading.Lock()
+
+def _path_db():
+    global _PATH_DB
+    with _PATH_DB_LOCK:
+        if _PATH_DB is None:
+            _PATH_DB = False  # 열기 실패 시 다시 시도하지 않음
+            if PATH_CACHE_DB:
+                try:
+                    conn = sqlite3.connect(PATH_CACHE_DB, timeout=5, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")  # 배차 작업자 여러 개가 동시에 읽고 씀
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS path (start TEXT, goal TEXT, geometry BLOB, PRIMARY KEY (start, goal))"
+                    )
+                    rows = conn.execute(
+                        "SELECT start, goal, geometry FROM path ORDER BY rowid DESC LIMIT ?",
+                        (max(0, PATH_CACHE_MAX_SIZE - len(PATH_CACHE)),)
+                    ).fetchall()
+                    with _PATH_CACHE_LOCK:
+                        for start, goal, geometry in reversed(rows):
+                            PATH_CACHE.setdefault(
+                                (sys.intern(start), sys.intern(goal)),
+                                np.asarray(orjson.loads(geometry), dtype=np.float64).reshape(-1, 2)
+                            )
+                    _PATH_DB = conn
+                except sqlite3.Error as e:
+                    print(f"⚠️ 경로 캐시 파일 사용 불가 (메모리 캐시만 사용): {e}")
+        return _PATH_DB or None
+
+def _save_paths(items):
+    """새로 받은 [(출발지명, 도착지명, 좌표 목록), ...]을 한 번의 트랜잭션으로 저장"""
+    conn = _path_db()
+    if conn is None or not items:
+        return
+    try:
+        with _PATH_DB_LOCK, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO path VALUES (?, ?, ?)", [(a, b, orjson.dumps(p, option=orjson.OPT_SERIALIZE_NUMPY)) for a, b, p in items]
+            )
+    except sqlite3.Error as e:
+        print(f"⚠️ 경로 캐시 저장 실패: {e}")
+
+# 🔹 상세 경로용 이벤트 루프 + AsyncClient는 스레드(배차 작업자)마다 하나씩 만들어 계속 재사용
+#    (요청마다 새 클라이언트를 만들면 매번 TCP/TLS 연결부터 다시 맺어야 함 → HTTP/2 연결을 요청 간에 유지)
+_GEOMETRY_LOCAL = threading.local()
+
+def _geometry_session():
+    session = getattr(_GEOMETRY_LOCAL, "session", None)
+    if session is None:
+        bucket = max(1, GEOMETRY_RATE_LIMIT // SOLVE_WORKERS)
+        session = (
+            uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop(),
+            httpx.AsyncClient(http2=True, headers=NAVER_HEADERS, limits=httpx.Limits(max_connections=16)),
+            # 🔹 토큰 버킷은 작업자 프로세스마다 따로 있으므로 전체 한도를 작업자 수로 나눔
+            #    (버킷 용량은 1 이상이어야 하므로 용량 대신 주기를 늘려 작업자당 속도를 맞춤)
+            AsyncLimiter(bucket, bucket * SOLVE_WORKERS / GEOMETRY_RATE_LIMIT),
+        )
+        _GEOMETRY_LOCAL.session = session
+    return session
+
+def get_detailed_paths_batch(edges):
+    """
+    edges: [(출발지명, 도착지명), ...] 구간 목록
+    모든 구간을 동시에 요청하여 (순차 호출 시 구간 수 × 응답시간) 대기를 없앰. 입력 순서대로 좌표 목록 반환.
+    GEOMETRY_BATCH_TIMEOUT 안에 끝나지 않은 구간은 취소하고 빈 경로로 채움 (배차 응답이 경로 조회 때문에 늦어지지 않도록)
+    """
+    if not edges or not NAVER_HEADERS:
+        return [NO_PATH for _ in edges]
+    # 🔹 여러 차량/라운드가 같은 구간(물류센터 → A 등)을 지나도 API는 구간마다 한 번만 호출
+    unique_edges = list(dict.fromkeys(edges))
+
+    _path_db()  # 첫 호출 시 저장된 경로 캐시 로드
+    loop, client, limiter = _geometry_session()
+    fetched = []  # 이번에 API로 새로 받은 구간 (끝난 뒤 파일 캐시에 저장)
+
+    async def _gather():
+        semaphore = asyncio.Semaphore(GEOMETRY_MAX_CONCURRENCY)
+
+        async def _bounded(a, b):
+            if (a, b) in PATH_CACHE:  # 캐시 적중 구간은 동시 요청 슬롯을 차지하지 않음
+                return PATH_CACHE[(a, b)]
+            async with semaphore:
+                path_data = await _fetch_path(client, a, b, limiter)
+            if len(path_data):
+                fetched.append((a, b, path_data))
+            return path_data
+
+        tasks = [asyncio.ensure_future(_bounded(a, b)) for a, b in unique_edges]
+        done, pending = await asyncio.wait(tasks, timeout=GEOMETRY_BATCH_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return [task.result() if task in done else NO_PATH for task in tasks]
+
+    results = dict(zip(unique_edges, loop.run_until_complete(_gather())))
+    _save_paths(fetched)
+    return [results[edge] for edge in edges]
+
+def attach_geometry(routes):
+    """
+    routes의 모든 구간 상세 좌표를 한 번에 조회해 경로마다 이어 붙인 geometry를 추가
+    """
+    edges = [
+        (r["path"][k].location, r["path"][k + 1].location)
+        for r in routes for k in range(len(r["path"]) - 1)
+    ]
+    segments = iter(get_detailed_paths_batch(edges))
+    for r in routes:
+        r["geometry"] = np.concatenate([next(segments) for _ in range(len(r["path"]) - 1)])
+
+def complete_matrix():
+    """
+    API 키가 없으면 빈 칸은 항상 하버사인 값이 되므로, 로드 시 한 번만 계산해 MATRIX_NP에 채워 둠
+    (매트릭스에 없는 좌표 지점도 행/열로 추가 → 요청마다 빈 칸을 다시 계산하지 않음)
+    API 키가 있으면 빈 칸은 요청 시 API로 조회해야 하므로 그대로 둠
+    """
+    global NAME_TO_IDX, MATRIX_NP
+    if NAVER_ID and NAVER_SECRET or not NODE_COORDS:
+        return
+    added = [name for name in NODE_COORDS if name not in NAME_TO_IDX]
+    n_missing = int((MATRIX_NP < 0).sum()) if NAME_TO_IDX else 0
+    if not added and not n_missing:
+        return
+    names = list(NAME_TO_IDX) + added
+    MATRIX_NP = build_duration_matrix(names)
+    NAME_TO_IDX = {name: i for i, name in enumerate(names)}
+    print(f"✅ 매트릭스 빈 칸 하버사인으로 보완: 빈 칸 {n_missing}개, 추가 지점 {len(added)}개")
+
+load_data()
 
 # ==========================================
 # 4. 배차 알고리즘
 # ==========================================
 
-def solve_multitrip_vrp(all_orders, all_vehicles, fuel_type):
+def solve_multitrip_vrp(fuel_orders, altteul_orders, my_vehicles, fuel_type, excluded_names=(), order_arr=None, verbose=True):
+    """
+    fuel_orders: 해당 유종 주문량이 있는 주문 (휘발유는 알뜰 제외)
+    altteul_orders: (휘발유 전용) 7408이 먼저 처리할 알뜰 주유소 주문
+    my_vehicles: 해당 유종 차량 (요청 수신 시 OptimizationRequest.vehicles_for로 분류)
+    excluded_names: 주문량 0으로 제외된 주유소명 (디버그 로그용)
+    order_arr: 일반 + 알뜰 순서의 build_order_array 결과 (없으면 여기서 생성)
+    """
+    is_gasoline = (fuel_type == FUEL_GAS)
+    service_time = GASOLINE_UNLOADING_TIME if is_gasoline else DIESEL_UNLOADING_TIME
     debug_logs = []
-    pending_orders = []
-    altteul_orders = []  # 🔹 (휘발유 전용) 알뜰 주유소 주문 리스트
 
     # 🔹 차량이 "다음 회차를 시작할 수 있는지" 판정 기준
     #   end_time = vehicle_state - LOADING_TIME 이므로,
     #   vehicle_state < WAREHOUSE_CLOSE_TIME + LOADING_TIME 가 되면 한 번 더 가능
     VEHICLE_AVAILABLE_THRESHOLD = WAREHOUSE_CLOSE_TIME + LOADING_TIME
 
-    # 1단계: 주문 분리
-    for o in all_orders:
-        amt = o.휘발유 if fuel_type == "휘발유" else (o.등유 + o.경유)
-        if amt > 0:
-            # 휘발유 모드에서는 알뜰 주문을 우선적으로 7408 전용 리스트에 분리
-            if fuel_type == "휘발유" and getattr(o, '브랜드', '') == '알뜰':
-                altteul_orders.append(o)
-            else:
-                pending_orders.append(o)
-        else:
-            if fuel_type == "휘발유" and (o.등유 > 0 or o.경유 > 0):
-                # 휘발유 모드에서 등/경유만 있는 주문은 디젤 단계에서 처리
-                pass
-            else:
-                debug_logs.append(f"제외됨(주문량0): {o.주유소명}")
+    # 1단계: 주문 분리 (요청 수신 시 OptimizationRequest.bin_orders에서 이미 분류됨)
+    if DEBUG:
+        debug_logs.extend(f"제외됨(주문량0): {name}" for name in excluded_names)
+
+    # 🔹 주문 속성을 한 번만 읽어 배열로 보관 (이후 라운드별 처리는 all_orders 위치 기준 마스크 연산)
+    #    all_orders = 일반 주문 + 알뜰 주문 순서
+    all_orders = list(fuel_orders) + list(altteul_orders)
+    n_orders = len(all_orders)
+    if order_arr is None:
+        order_arr = build_order_array(all_orders)
+    gas_amt = order_arr[:, COL_GAS]
+    dk_amt = order_arr[:, COL_KEROSENE] + order_arr[:, COL_DIESEL]
+    end_min = order_arr[:, COL_END]
+    order_amt = gas_amt if is_gasoline else dk_amt
+
+    altteul_mask = np.arange(n_orders) >= len(fuel_orders)  # 🔹 (휘발유 전용) 알뜰 주유소 주문
+    pending_mask = ~altteul_mask
 
-    my_vehicles = [v for v in all_vehicles if v.유종 == fuel_type]
-    
     # 처리할 주문(알뜰 + 일반)이 하나도 없으면 스킵
-    if (not pending_orders and not altteul_orders) or not my_vehicles:
+    if not n_orders or not my_vehicles:
         return {"status": "skipped", "routes": [], "debug_logs": debug_logs}
 
+    # 🔹 물류센터 + 전체 주문 소요시간 매트릭스를 한 번만 만들고, 라운드마다 남은 주문의 행/열만 잘라서 사용
+    #    (0번 = 물류센터, i+1번 = all_orders[i], 스킵 판정 뒤에 만들어 배차하지 않을 구간은 API 호출 안 함)
+    req_durations = build_duration_matrix(["제주물류센터"] + [o.주유소명 for o in all_orders])
+    # 물류센터→주유소 이동시간 (재시도 필터에서 재사용)
+    depot_travel = req_durations[0, 1:].astype(np.int64)
+
     # 휘발유인 경우 제주96바7408 차량 찾기 (알뜰 주유소 우선 차량)
     preferred_vehicle_idx = None
-    if fuel_type == "휘발유":
-        for i, v in enumerate(my_vehicles):
-            if v.차량번호 == "제주96바7408":
-                preferred_vehicle_idx = i
-                break
+    if is_gasoline:
+        preferred_vehicle_idx = next(
+            (i for i, v in enumerate(my_vehicles) if v.차량번호 == ALTTEUL_PREFERRED_VEHICLE), None
+        )
 
-    vehicle_state = {i: DRIVER_START_TIME for i in range(len(my_vehicles))} 
-    vehicle_workload = {i: 0 for i in range(len(my_vehicles))}  # 누적 수송량
+    # 🔹 차량별 다음 출발 가능 시간 / 누적 수송량 (my_vehicles 위치 기준 배열, 라운드별 필터링을 벡터 연산으로)
+    vehicle_state = np.full(len(my_vehicles), DRIVER_START_TIME, dtype=np.int64)
+    vehicle_workload = np.zeros(len(my_vehicles), dtype=np.int64)
     final_schedule = []
+    total_delivered = 0       # 배차 결과 집계는 경로 추가 시점에 바로 누적
+    used_vehicle_ids = set()
     round_altteul = 1  # 🔹 7408 알뜰 전용 라운드 번호
 
     # ==========================================
     # 4-1. (휘발유) 알뜰 주유소: 7408이 가능할 때까지 먼저 최대한 배차
     #      - 여기서 처리하지 못한 알뜰은 나중에 SK와 합쳐서 7400/7403이 처리
     # ==========================================
-    if fuel_type == "휘발유" and preferred_vehicle_idx is not None and altteul_orders:
-        while altteul_orders and vehicle_state[preferred_vehicle_idx] < VEHICLE_AVAILABLE_THRESHOLD:
+    if is_gasoline and preferred_vehicle_idx is not None and altteul_mask.any():
+        while altteul_mask.any() and vehicle_state[preferred_vehicle_idx] < VEHICLE_AVAILABLE_THRESHOLD:
             preferred_vehicle = [my_vehicles[preferred_vehicle_idx]]
-            preferred_start = [vehicle_state[preferred_vehicle_idx]]
+            preferred_start = [int(vehicle_state[preferred_vehicle_idx])]
+            altteul_idx = np.flatnonzero(altteul_mask)
 
-            routes_preferred, remaining_altteul = run_ortools(
-                altteul_orders, preferred_vehicle, preferred_start, fuel_type, preferred_vehicle_idx=0
+            routes_preferred, fulfilled = run_ortools(
+                [all_orders[i] for i in altteul_idx], preferred_vehicle, preferred_start, fuel_type, preferred_vehicle_idx=0,
+                order_arr=order_arr[altteul_idx], durations=sub_durations(req_durations, altteul_idx),
             )
 
             if not routes_preferred:
@@ -304,89 +811,103 @@ def solve_multitrip_vrp(all_orders, all_vehicles, fuel_type):
                 r['round'] = round_altteul
                 r['vehicle_id'] = my_vehicles[preferred_vehicle_idx].차량번호
                 final_schedule.append(r)
+                total_delivered += r["total_load"]
+                used_vehicle_ids.add(r['vehicle_id'])
 
-            altteul_orders = remaining_altteul
+            altteul_mask[altteul_idx[fulfilled]] = False
             round_altteul += 1
             if round_altteul > 10:
-                debug_logs.append("알뜰 전용 단계에서 라운드 10회를 초과하여 안전 종료")
+                if DEBUG:
+                    debug_logs.append("알뜰 전용 단계에서 라운드 10회를 초과하여 안전 종료")
                 break
 
         # 7408이 처리하지 못한 알뜰 주문은 SK 주문과 합쳐서 다음 단계에서 7400/7403이 함께 처리
-        pending_orders = pending_orders + altteul_orders
+        pending_mask |= altteul_mask
 
     # ==========================================
     # 🔹 SK + (남은 알뜰) 단계 라운드 번호는 다시 1부터 시작
     # ==========================================
     round_main = 1
 
+    # 🔹 이 단계 차량 중 가장 큰 차량보다 많은 주문은 어느 라운드에서도 배차할 수 없으므로 처음부터 후보에서 빼고
+    #    미처리 주문(차량 용량 초과)으로 보고 (run_ortools 사전 필터에서 빠진 주문을 재시도 루프가 계속 다시 넣지 않도록)
+    #    (이 단계에 쓸 차량이 아예 없으면 용량 문제가 아니므로 표시하지 않고 기존대로 시간/차량 부족으로 보고)
+    main_capacity = max(
+        (v.수송용량 for i, v in enumerate(my_vehicles) if not (is_gasoline and i == preferred_vehicle_idx)), default=None
+    )
+    if main_capacity is None:
+        over_capacity = np.zeros(n_orders, dtype=bool)
+    else:
+        over_capacity = order_amt > main_capacity
+
     # ==========================================
     # 4-2. 나머지 주문:
     #      - 휘발유: SK + (남은 알뜰) → 7400/7403 등으로 처리, 7408은 제외
     #      - 디젤: 전체 유효 주문을 모든 디젤 차량으로 처리
     # ==========================================
     while True:
-        if not pending_orders:
+        # 참고: 남은 주문을 (우선순위, 종료시간, -수량) 순으로 정렬해 넘겨도 주문 12~60건 사례에서
+        # 같은 탐색 시간 내 목적함수가 동일했으므로 (GLS가 노드 순서 영향을 상쇄) 원래 순서 그대로 사용
+        pending_idx = np.flatnonzero(pending_mask & ~over_capacity)
+        if not pending_idx.size:
             break
-        available_indices = [i for i, t in vehicle_state.items() if t < VEHICLE_AVAILABLE_THRESHOLD]
-        if not available_indices:
+        available_indices = np.flatnonzero(vehicle_state < VEHICLE_AVAILABLE_THRESHOLD)
+        if not available_indices.size:
             break
 
         # 지금까지 누적 작업량이 적은 차량부터 우선 사용
-        available_indices = [i for i, t in vehicle_state.items() if t < VEHICLE_AVAILABLE_THRESHOLD]
-        if not available_indices:
-            break
-        available_indices.sort(key=lambda i: vehicle_workload[i])
+        available_indices = available_indices[np.argsort(vehicle_workload[available_indices], kind="stable")]
         
         # 휘발유의 2단계(SK+남은 알뜰)는 7408을 제외하고 7400/7403 등만 사용
-        if fuel_type == "휘발유" and preferred_vehicle_idx is not None:
-            available_indices = [i for i in available_indices if i != preferred_vehicle_idx]
-            if not available_indices:
+        if is_gasoline and preferred_vehicle_idx is not None:
+            available_indices = available_indices[available_indices != preferred_vehicle_idx]
+            if not available_indices.size:
                 break
         
         current_vehicles = [my_vehicles[i] for i in available_indices]
-        current_starts = [vehicle_state[i] for i in available_indices]
+        current_starts = vehicle_state[available_indices].tolist()
         
         # 남은 주문 처리 (휘발유: SK+남은 알뜰, 디젤: 전체)
-        routes, remaining = run_ortools(pending_orders, current_vehicles, current_starts, fuel_type, preferred_vehicle_idx=None)
+        routes, fulfilled = run_ortools(
+            [all_orders[i] for i in pending_idx], current_vehicles, current_starts, fuel_type, preferred_vehicle_idx=None,
+            order_arr=order_arr[pending_idx], durations=sub_durations(req_durations, pending_idx),
+        )
         
         # OR-Tools가 해를 찾지 못했을 때 처리
-        if not routes and len(remaining) == len(pending_orders):
+        if not routes and not fulfilled.any():
             # 모든 차량이 18:00 이후가 되었는지 확인
-            all_vehicles_after_close = all(vehicle_state[i] >= VEHICLE_AVAILABLE_THRESHOLD for i in range(len(my_vehicles)))
+            all_vehicles_after_close = bool((vehicle_state >= VEHICLE_AVAILABLE_THRESHOLD).all())
             if all_vehicles_after_close:
-                debug_logs.append(f"라운드 {round_main}: 모든 차량이 18:00 이후, 배차 종료")
+                if DEBUG:
+                    debug_logs.append(f"라운드 {round_main}: 모든 차량이 18:00 이후, 배차 종료")
                 break
             
             # 일부 차량이 아직 18:00 전이면, 시간 제약이 너무 엄격한 주문을 필터링하고 재시도
             min_available_start = min(current_starts) if current_starts else WAREHOUSE_CLOSE_TIME
-            processable_orders = []
-            skipped_due_to_time = []
-            depot = "제주물류센터"
-
-            for order in pending_orders:
-                travel_time = get_driving_time(depot, order.주유소명)
-                service_time = GASOLINE_UNLOADING_TIME if fuel_type == "휘발유" else DIESEL_UNLOADING_TIME
-                min_arrival = min_available_start + travel_time + service_time
-                
-                if order.end_min >= min_arrival:
-                    processable_orders.append(order)
-                else:
-                    skipped_due_to_time.append(order.주유소명)
-            
-            if skipped_due_to_time:
-                debug_logs.append(
-                    f"라운드 {round_main}: 시간 제약으로 처리 불가능한 주문 {len(skipped_due_to_time)}개: "
-                    f"{', '.join(skipped_due_to_time[:3])}{'...' if len(skipped_due_to_time) > 3 else ''}"
-                )
+            processable = end_min[pending_idx] >= min_available_start + depot_travel[pending_idx] + service_time
+            if DEBUG:
+                skipped_due_to_time = [all_orders[i].주유소명 for i in pending_idx[~processable]]
+                if skipped_due_to_time:
+                    debug_logs.append(
+                        f"라운드 {round_main}: 시간 제약으로 처리 불가능한 주문 {len(skipped_due_to_time)}개: "
+                        f"{', '.join(skipped_due_to_time[:3])}{'...' if len(skipped_due_to_time) > 3 else ''}"
+                    )
             
-            if processable_orders:
-                pending_orders = processable_orders
-                debug_logs.append(
-                    f"라운드 {round_main}: OR-Tools 해 탐색 실패, 처리 가능한 주문 {len(processable_orders)}개로 재시도"
-                )
+            if processable.all():
+                # 걸러낼 주문이 없으면 같은 입력으로 다시 풀어도 결과가 같으므로 종료 (무한 재시도 방지)
+                if DEBUG:
+                    debug_logs.append(f"라운드 {round_main}: OR-Tools 해 탐색 실패, 제외할 주문 없음, 배차 종료")
+                break
+            if processable.any():
+                pending_mask[pending_idx[~processable]] = False
+                if DEBUG:
+                    debug_logs.append(
+                        f"라운드 {round_main}: OR-Tools 해 탐색 실패, 처리 가능한 주문 {int(processable.sum())}개로 재시도"
+                    )
                 continue  # 다음 라운드로
             else:
-                debug_logs.append(f"라운드 {round_main}: 처리 가능한 주문 없음, 배차 종료")
+                if DEBUG:
+                    debug_logs.append(f"라운드 {round_main}: 처리 가능한 주문 없음, 배차 종료")
                 break
 
         # 해를 찾았을 때 차량 상태 업데이트
@@ -397,66 +918,107 @@ def solve_multitrip_vrp(all_orders, all_vehicles, fuel_type):
             r['round'] = round_main
             r['vehicle_id'] = my_vehicles[real_v_idx].차량번호
             final_schedule.append(r)
+            total_delivered += r["total_load"]
+            used_vehicle_ids.add(r['vehicle_id'])
             
-        pending_orders = remaining
+        pending_mask[pending_idx[fulfilled]] = False
         round_main += 1
         
         # 안전장치: 라운드 과도 증가 방지
         if round_main > 10:
-            debug_logs.append("일반 단계에서 라운드 10회를 초과하여 안전 종료")
+            if DEBUG:
+                debug_logs.append("일반 단계에서 라운드 10회를 초과하여 안전 종료")
             break
 
+    # 상세 경로는 모든 라운드가 끝난 뒤 전체 배차 결과에 대해 한 번만 조회
+    if INCLUDE_GEOMETRY and final_schedule:
+        attach_geometry(final_schedule)
+
     # 미처리 주문 상세 정보 생성
-    skipped_list = []
-    for o in pending_orders:
-        order_info = {
-            "주유소명": o.주유소명,
-            "브랜드": getattr(o, '브랜드', ''),
-            "요청물량": {
-                "휘발유": o.휘발유 if fuel_type == "휘발유" else 0,
-                "등유": o.등유 if fuel_type != "휘발유" else 0,
-                "경유": o.경유 if fuel_type != "휘발유" else 0
-            },
-            "총요청물량": o.휘발유 if fuel_type == "휘발유" else (o.등유 + o.경유),
-            "시간제약": {
-                "시작시간": f"{o.start_min // 60:02d}:{o.start_min % 60:02d}",
-                "종료시간": f"{o.end_min // 60:02d}:{o.end_min % 60:02d}",
-                "start_min": o.start_min,
-                "end_min": o.end_min
-            },
-            "우선순위": o.priority,
-            "미처리이유": "시간/차량 부족"
-        }
-        skipped_list.append(order_info)
+    skipped_list = [
+        build_unassigned_info(
+            all_orders[i], int(order_amt[i]), is_gasoline, verbose,
+            reason="차량 용량 초과" if over_capacity[i] else "시간/차량 부족",
+        )
+        for i in np.flatnonzero(pending_mask)
+    ]
 
     return {
         "status": "success", 
-        "total_delivered": sum(r['total_load'] for r in final_schedule),
-        "total_vehicles_used": len(set(r['vehicle_id'] for r in final_schedule)),
+        "total_delivered": total_delivered,
+        "total_vehicles_used": len(used_vehicle_ids),
         "routes": final_schedule, 
         "unassigned_orders": skipped_list,
         "unassigned_count": len(skipped_list),
-        "unassigned_total_load": sum(o["총요청물량"] for o in skipped_list),
+        "unassigned_total_load": int(order_amt[pending_mask].sum()),
         "debug_logs": debug_logs
     }
 
-def run_ortools(orders, vehicles, start_times, fuel_type, preferred_vehicle_idx=None):
+def build_unassigned_info(o, total_amt, is_gasoline, verbose=True, reason="시간/차량 부족"):
+    """
+    미처리 주문 응답 항목 생성. verbose=False면 요청물량/시간제약 상세를 생략해 응답 크기를 줄임
+    """
+    if not verbose:
+        return {
+            "주유소명": o.주유소명,
+            "브랜드": o.브랜드,
+            "총요청물량": total_amt,
+            "우선순위": o.priority,
+            "미처리이유": reason
+        }
+    return {
+        "주유소명": o.주유소명,
+        "브랜드": o.브랜드,
+        "요청물량": {
+            "휘발유": o.휘발유 if is_gasoline else 0,
+            "등유": o.등유 if not is_gasoline else 0,
+            "경유": o.경유 if not is_gasoline else 0
+        },
+        "총요청물량": total_amt,
+        "시간제약": {
+            "시작시간": format_minutes(o.start_min),
+            "종료시간": format_minutes(o.end_min),
+            "start_min": o.start_min,
+            "end_min": o.end_min
+        },
+        "우선순위": o.priority,
+        "미처리이유": reason
+    }
+
+def run_ortools(orders, vehicles, start_times, fuel_type, preferred_vehicle_idx=None, order_arr=None, durations=None):
     """
     preferred_vehicle_idx: 알뜰 주유소를 처리할 우선 차량 인덱스 (None이면 제약 없음)
+    order_arr: orders와 같은 순서의 build_order_array 결과 (없으면 여기서 생성)
+    durations: [물류센터] + orders 순서의 소요시간 매트릭스 (없으면 여기서 생성)
     """
     depot = "제주물류센터"
     locs = [depot] + [o.주유소명 for o in orders]
-    N = len(locs)
+    # 유종별 분기를 한 번만 계산
+    is_gasoline = (fuel_type == FUEL_GAS)
+    service_time = GASOLINE_UNLOADING_TIME if is_gasoline else DIESEL_UNLOADING_TIME
+    if order_arr is None:
+        order_arr = build_order_array(orders)
     
     # 1. 거리 매트릭스 생성 (여기서 API 대신 로컬 매트릭스 활용)
-    durations = [[0]*N for _ in range(N)]
-    for i in range(N):
-        for j in range(N):
-            if i != j: durations[i][j] = get_driving_time(locs[i], locs[j])
+    if durations is None:
+        durations = build_duration_matrix(locs)
+    # 🔹 물류센터→주유소 이동시간은 매트릭스 0번 행을 그대로 사용 (주문마다 get_driving_time 조회하지 않음)
+    min_travel_time = durations[0, 1:].astype(np.int64)
+
+    min_start_time = min(start_times) if start_times else DRIVER_START_TIME
+    # 🔹 주문의 종료 시간이 너무 이른 경우를 대비하여, 최소한 가장 이른 차량의 시작 시간 + 이동시간 + 하역시간 이상으로 설정
+    # (단, 원래 end_min이 더 늦으면 원래 값 사용, 또는 18:00 이후인 경우 23:59까지 허용)
+    order_end = order_arr[:, COL_END]
+    min_arrival_time = min_start_time + min_travel_time + service_time
+    # 원래 end_min이 18:00 이후면 원래 값 사용, 너무 이르면 최소 도착 시간으로 조정 (더 이른 값 중 큰 값 사용)
+    effective_end_min = np.where(
+        order_end >= WAREHOUSE_CLOSE_TIME, order_end, np.maximum(order_end, min_arrival_time)
+    )
+
+    # 수요량은 C++ 쪽 벡터로 한 번만 넘겨 용량 평가 시 Python 콜백 호출을 없앰
+    order_amt = order_arr[:, COL_GAS] if is_gasoline else order_arr[:, COL_KEROSENE] + order_arr[:, COL_DIESEL]
+    demands = [0] + order_amt.tolist()
 
-    manager = pywrapcp.RoutingIndexManager(N, len(vehicles), 0)
-    routing = pywrapcp.RoutingModel(manager)
-    
     # 🔹 알뜰 주유소는 preferred_vehicle_idx 차량만 방문하도록 제약
     # 참고: solve_multitrip_vrp에서 이미 preferred_vehicle 리스트에 제주96바7408만 넣었으므로
     # vehicles 리스트에 원하는 차량만 들어있어 자동으로 제약이 적용됩니다.
@@ -464,35 +1026,143 @@ def run_ortools(orders, vehicles, start_times, fuel_type, preferred_vehicle_idx=
     # 현재 구조에서는 vehicles 리스트 필터링만으로도 충분합니다.
     # 
     # 만약 추가 제약이 필요한 경우 (예: 여러 차량 중 특정 차량만 선택):
-    # if preferred_vehicle_idx is not None and fuel_type == "휘발유":
+    # if preferred_vehicle_idx is not None and fuel_type == FUEL_GAS:
     #     for i, order in enumerate(orders):
     #         if getattr(order, '브랜드', '') == '알뜰':
     #             index = manager.NodeToIndex(i + 1)
     #             # OR-Tools 9.12+ 에서는 SetAllowedVehiclesForIndex 사용 가능
     #             routing.SetAllowedVehiclesForIndex([preferred_vehicle_idx], index)
 
-    def time_callback(from_i, to_i):
-        f, t = manager.IndexToNode(from_i), manager.IndexToNode(to_i)
-        if t != 0:
-            # 유종에 따라 하역 시간 다르게 적용
-            service = GASOLINE_UNLOADING_TIME if fuel_type == "휘발유" else DIESEL_UNLOADING_TIME
-        else:
-            service = 0
-        return durations[f][t] + service
+    # 🔹 어느 차량으로도 처리할 수 없는 주문은 이번 라운드 모델에서 제외하여 탐색 범위를 줄임
+    #    (가장 이른 차량도 시간창 안에 도착 불가 / 1440분 안에 복귀 불가 / 최대 수송용량 초과)
+    #    제외된 주문은 미방문으로 남아 호출 측에서 다음 라운드 또는 미배차로 처리
+    capacities = [v.수송용량 for v in vehicles]
+    visit_time = np.maximum(min_arrival_time, order_arr[:, COL_START])
+    feasible_idx = np.flatnonzero(
+        (visit_time <= effective_end_min)
+        & (visit_time + durations[1:, 0] <= 1440)
+        & (order_amt <= max(capacities))
+    )
+    model_durations = sub_durations(durations, feasible_idx) if feasible_idx.size < len(orders) else durations
+    model_demands = [0] + order_amt[feasible_idx].tolist()
+
+    # 🔹 주문 1건 라운드는 OR-Tools 모델을 만들지 않고 바로 계산 (모델 생성 + 탐색 시간 제한만큼 기다리지 않도록)
+    if not feasible_idx.size:
+        visits = []
+    elif feasible_idx.size == 1:
+        i = feasible_idx[0]
+        visits = solve_single_order(
+            model_durations, service_time, start_times, capacities,
+            model_demands[1], int(order_arr[i, COL_START]), int(effective_end_min[i])
+        )
+    else:
+        # 참고: 주문 40건/차량 3대 라운드에서 PyVRP(HGS)와 비교했을 때 같은 시간 제한에서 배송량이 같거나 적고
+        # 실행 시간은 4~5초 더 길어 OR-Tools만 사용
+        visits = solve_routing_model(
+            model_durations, service_time, start_times, capacities,
+            model_demands, order_arr[feasible_idx], effective_end_min[feasible_idx]
+        )
+    # 모델 노드 번호 → 이번 라운드 주문 기준 노드 번호 (0번 물류센터는 그대로)
+    if feasible_idx.size < len(orders):
+        node_map = [0] + (feasible_idx + 1).tolist()
+        visits = [(v_idx, [(node_map[n], t) for n, t in stops], end) for v_idx, stops, end in visits]
 
-    transit_idx = routing.RegisterTransitCallback(time_callback)
+    routes = []
+    fulfilled_indices = set()
+    no_coord = (0, 0)
+    depot_lat, depot_lon = NODE_COORDS.get(depot, no_coord)  # 모든 경로의 마지막 지점이므로 한 번만 조회
+    for v_idx, stops, end_time in visits:
+        path = []
+        load = 0
+        for node_idx, t_val in stops:
+            if node_idx > 0: fulfilled_indices.add(node_idx - 1)
+            node_name = locs[node_idx]
+            lat, lon = NODE_COORDS.get(node_name, no_coord)
+            path.append(Waypoint(node_name, lat, lon, t_val, demands[node_idx]))
+            load += demands[node_idx]
+
+        path.append(Waypoint(depot, depot_lat, depot_lon, end_time, 0))
+
+        # 시작 시간 = 첫 번째 노드(물류센터 출발)의 시간
+        start_time = path[0].time
+        routes.append({
+            "internal_idx": v_idx, 
+            "start_time": start_time,
+            "start_time_formatted": format_minutes(start_time),
+            "end_time": end_time,
+            "end_time_formatted": format_minutes(end_time),
+            "total_load": load, 
+            "path": path
+        })
+
+    # 방문한 주문 위치 마스크 (호출 측에서 남은 주문을 마스크 연산으로 갱신)
+    fulfilled = np.zeros(len(orders), dtype=bool)
+    fulfilled[list(fulfilled_indices)] = True
+    return routes, fulfilled
+
+def solve_single_order(durations, service_time, start_times, capacities, demand, start_min, end_min):
+    """
+    주문 1건을 OR-Tools 모델과 같은 기준으로 배차: [(차량 번호, [(노드, 시간)...], 복귀 시간)] (불가능하면 [])
+    - 도착 시간 = 출발 + 이동 + 하역 (start_min보다 이르면 물류센터에서 대기), 1440분 이내 복귀
+    - 비용(이동 + 하역 + 대기)은 대기 시간만 차량마다 다르므로 대기가 가장 짧은 차량, 같으면 앞 번호 차량
+    """
+    go, back = int(durations[0, 1]), int(durations[1, 0])
+    best = None
+    for v_idx, (start, capacity) in enumerate(zip(start_times, capacities)):
+        start = int(start)
+        if demand > capacity:
+            continue
+        arrival = start + go + service_time
+        visit_time = max(arrival, start_min)
+        if visit_time > end_min or visit_time + back > 1440:
+            continue
+        wait = visit_time - arrival
+        if best is None or wait < best[0]:
+            best = (wait, v_idx, start, visit_time)
+    if best is None:
+        return []
+    _, v_idx, start, visit_time = best
+    return [(v_idx, [(0, start), (1, visit_time)], visit_time + back)]
+
+def solve_routing_model(durations, service_time, start_times, capacities, demands, order_arr, effective_end_min):
+    """
+    OR-Tools 라우팅 모델로 배차: 주문이 하나 이상 있는 차량별 [(차량 번호, [(노드, 시간)...], 복귀 시간)]
+    """
+    N = len(durations)
+    # 이동시간 + 도착지 하역시간 (물류센터 도착 시에는 하역 없음), 배열 연산으로 만든 뒤 한 번에 리스트 변환
+    # 🔹 분 단위 값이라 int32로 충분하므로 별도 int64 복사 없이 그대로 더함
+    transit = durations + np.int32(service_time)
+    transit[:, 0] -= service_time
+    transit_matrix = transit.tolist()
+
+    from ortools.constraint_solver import pywrapcp, routing_enums_pb2, solver_parameters_pb2
+    manager = pywrapcp.RoutingIndexManager(N, len(capacities), 0)
+    # 🔹 모델 파라미터: 모든 차량이 같은 비용 매트릭스를 공유(reduce_vehicle_cost_model),
+    #    탐색 trail 압축/변수 이름 저장은 작은 모델에서 메모리 이득보다 CPU 비용이 커서 끔
+    #    (콜백을 쓰지 않고 매트릭스로 등록하므로 max_callback_cache_size는 해당 없음)
+    model_params = pywrapcp.DefaultRoutingModelParameters()
+    model_params.reduce_vehicle_cost_model = True
+    model_params.solver_parameters.compress_trail = solver_parameters_pb2.ConstraintSolverParameters.NO_COMPRESSION
+    model_params.solver_parameters.store_names = False
+    routing = pywrapcp.RoutingModel(manager, model_params)
+
+    # 🔹 Python 콜백 대신 매트릭스를 C++ 쪽에 통째로 넘겨, 탐색 중 구간 평가마다 Python을 호출하지 않음
+    transit_idx = routing.RegisterTransitMatrix(transit_matrix)
     routing.SetArcCostEvaluatorOfAllVehicles(transit_idx)
 
-    routing.AddDimension(transit_idx, 1440, 1440, False, "Time")
+    # 🔹 대기(slack)는 주문의 start_min까지 기다릴 때만 필요하므로, 가장 이른 차량 출발 ~ 가장 늦은 start_min 사이로 제한
+    #    (탐색 변수 범위를 줄여도 가능한 해 집합은 동일. 복귀 시간은 18:00 이후도 허용하므로 하루 1440분은 유지)
+    max_wait = max(0, int(order_arr[:, COL_START].max()) - min(int(t) for t in start_times))
+    routing.AddDimension(transit_idx, max_wait, 1440, False, "Time")
     time_dim = routing.GetDimensionOrDie("Time")
     
     if hasattr(time_dim, "SetSlackCostCoefficientForAllVehicles"):
         time_dim.SetSlackCostCoefficientForAllVehicles(1)
     else:
-        print("⚠️ SetSlackCostCoefficientForAllVehicles 지원 안 하는 OR-Tools 버전입니다.")
+        warn_once("⚠️ SetSlackCostCoefficientForAllVehicles 지원 안 하는 OR-Tools 버전입니다.")
 
     
-    for i in range(len(vehicles)):
+    for i in range(len(capacities)):
         idx = routing.Start(i)
         start_time = int(start_times[i])
         # 🔹 모든 차량이 정확히 지정된 시간(7:00)에 시작하도록 제약 설정
@@ -500,127 +1170,153 @@ def run_ortools(orders, vehicles, start_times, fuel_type, preferred_vehicle_idx=
         time_dim.CumulVar(idx).SetMax(start_time)  # 최소값과 최대값을 동일하게 설정하여 정확히 해당 시간에 시작
         # 참고: 차량이 물류센터에 돌아오는 시간은 제약하지 않음 (18:00 이후에도 수송 가능)
         # 새로운 배차 시작은 WAREHOUSE_CLOSE_TIME(18:00) 조건으로 제어됨
-    
-    for i, order in enumerate(orders):
+
+    # 🔹 priority에 따라 패널티를 다르게 주되, 모든 주문은 Disjunction으로 "선택적 방문"으로 모델링
+    #    - priority 1: 거의 반드시 가야 하지만, 물리적으로 불가능한 경우를 위해서라도 드물게 제외 가능하게 함 (10,000,000)
+    #    - priority 2: 기본값 (일반 주문, 1,000,000)
+    #    - priority 3 이상: 상대적으로 덜 중요한 주문 (100,000)
+    priority = order_arr[:, COL_PRIORITY]
+    penalties = np.where(priority <= 1, 10_000_000, np.where(priority == 2, 1_000_000, 100_000))
+
+    for i, (start_min, end_min, penalty) in enumerate(
+        zip(order_arr[:, COL_START].tolist(), effective_end_min.tolist(), penalties.tolist())
+    ):
         index = manager.NodeToIndex(i + 1)
-        # 🔹 주문의 종료 시간이 너무 이른 경우를 대비하여, 최소한 가장 이른 차량의 시작 시간 + 이동시간 + 하역시간 이상으로 설정
-        # (단, 원래 end_min이 더 늦으면 원래 값 사용, 또는 18:00 이후인 경우 23:59까지 허용)
-        min_start_time = min(start_times) if start_times else DRIVER_START_TIME
-        min_travel_time = get_driving_time(depot, order.주유소명)
-        min_service_time = GASOLINE_UNLOADING_TIME if fuel_type == "휘발유" else DIESEL_UNLOADING_TIME
-        min_arrival_time = min_start_time + min_travel_time + min_service_time
-        
-        # 원래 end_min이 18:00 이후이거나, 계산된 최소 도착 시간보다 늦으면 그대로 사용
-        # 원래 end_min이 너무 이르면 최소 도착 시간으로 조정 (단, 원래 값이 18:00 이후면 원래 값 사용)
-        if order.end_min >= WAREHOUSE_CLOSE_TIME:
-            effective_end_min = order.end_min  # 18:00 이후면 원래 값 사용
-        else:
-            effective_end_min = max(order.end_min, min_arrival_time)  # 더 이른 값 중 큰 값 사용
-        
-        time_dim.CumulVar(index).SetRange(order.start_min, effective_end_min)
-        
-        # 🔹 priority에 따라 패널티를 다르게 주되, 모든 주문은 Disjunction으로 "선택적 방문"으로 모델링
-        #    - priority 1: 거의 반드시 가야 하지만, 물리적으로 불가능한 경우를 위해서라도 드물게 제외 가능하게 함
-        #    - priority 2: 기본값 (일반 주문)
-        #    - priority 3 이상: 상대적으로 덜 중요한 주문
-        if order.priority <= 1:
-            penalty = 10_000_000  # 매우 크게 (가능하면 반드시 방문)
-        elif order.priority == 2:
-            penalty = 1_000_000   # 기본 패널티
-        else:
-            penalty = 100_000     # 덜 중요한 주문은 상대적으로 낮게
+        time_dim.CumulVar(index).SetRange(start_min, end_min)
         routing.AddDisjunction([index], penalty)
 
 
-    demands = [0] + [ (o.휘발유 if fuel_type=="휘발유" else o.등유+o.경유) for o in orders ]
-    def demand_callback(from_i):
-        return demands[manager.IndexToNode(from_i)]
-    cap_idx = routing.RegisterUnaryTransitCallback(demand_callback)
-    routing.AddDimensionWithVehicleCapacity(cap_idx, 0, [v.수송용량 for v in vehicles], True, "Capacity")
+    cap_idx = routing.RegisterUnaryTransitVector(demands)
+    routing.AddDimensionWithVehicleCapacity(cap_idx, 0, capacities, True, "Capacity")
 
     search_params = pywrapcp.DefaultRoutingSearchParameters()
+    # 참고: 주문 20~50건, 시간창 있는 사례에서 PARALLEL_CHEAPEST_INSERTION과 비교했을 때 같은 탐색 시간 내
+    # 목적함수(미방문 패널티)가 더 좋지 않아 PATH_CHEAPEST_ARC 유지 (GLS가 초기해 차이를 대부분 상쇄)
     search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    search_params.time_limit.seconds = 10  # 🔹 최적화 시간을 늘려서 더 나은 해를 찾도록
+    # 🔹 주문이 적으면 GLS가 금방 수렴하므로 짧게, 많으면 최적화 시간을 늘려서 더 나은 해를 찾도록
+    search_params.time_limit.seconds = SMALL_SOLVE_TIME_LIMIT if N - 1 < SMALL_SOLVE_MAX_ORDERS else SOLVE_TIME_LIMIT
+    # 🔹 작은 라운드는 GLS가 해 1000개 안에 수렴하므로 시간 제한을 다 쓰지 않고 종료 (3초 → 보통 1초 미만)
+    #    (주문 50건 라운드에서는 해 개수 제한 시 미방문 주문이 늘어나는 경우가 있어 시간 제한만 적용)
+    if N - 1 < SMALL_SOLVE_MAX_ORDERS:
+        search_params.solution_limit = SMALL_SOLVE_SOLUTION_LIMIT
+    search_params.log_search = False
+    search_params.use_full_propagation = False
+    search_params.number_of_solutions_to_collect = 1  # 최종 해 하나만 필요
     # 🔹 차량이 가능한 한 빨리 시작하도록 최적화
     search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    # 참고: 이전 라운드 해를 ReadAssignmentFromRoutes로 넘기는 warm start는 사용하지 않음
+    # 한 라운드에서 경로에 포함된 주문은 모두 배차 완료(fulfilled)되어 다음 라운드 후보에서 빠지므로
+    # 다음 라운드에 재사용할 수 있는 경로 노드가 남지 않음 (매 라운드 PATH_CHEAPEST_ARC로 새로 시작)
     solution = routing.SolveWithParameters(search_params)
-    
-    routes = []
-    fulfilled_indices = set()
-    
+
+    visits = []
     if solution:
-        for v_idx in range(len(vehicles)):
+        # 🔹 해 순회 중 반복 호출하는 C++ 바인딩 메서드는 지역 변수로 한 번만 조회
+        index_to_node, is_end, next_var = manager.IndexToNode, routing.IsEnd, routing.NextVar
+        cumul_var, sol_min, sol_value = time_dim.CumulVar, solution.Min, solution.Value
+        for v_idx in range(len(capacities)):
             index = routing.Start(v_idx)
-            path = []
-            load = 0
-            # geometry_list = [] # 상세 경로 (일단 비활성화)
-
-            while not routing.IsEnd(index):
-                node_idx = manager.IndexToNode(index)
-                if node_idx > 0: fulfilled_indices.add(node_idx - 1)
-                
-                t_val = solution.Min(time_dim.CumulVar(index))
-                node_name = locs[node_idx]
-                coord = NODE_INFO.get(node_name, {"lat": 0, "lon": 0})
-                
-                path.append({
-                    "location": node_name,
-                    "lat": coord["lat"], "lon": coord["lon"],
-                    "time": t_val, "load": demands[node_idx]
-                })
-                load += demands[node_idx]
-
-                next_index = solution.Value(routing.NextVar(index))
-                # 상세 경로는 여기서 API 호출 (현재 비활성화 - 응답 데이터 축소)
-                # if not routing.IsEnd(next_index):
-                #     next_node_idx = manager.IndexToNode(next_index)
-                #     segment_path = get_detailed_path_geometry(node_name, locs[next_node_idx])
-                #     if segment_path: geometry_list.extend(segment_path)
-                
-                index = next_index
-
-            node_idx = manager.IndexToNode(index)
-            end_time = solution.Min(time_dim.CumulVar(index))
-            depot_coord = NODE_INFO.get(depot, {"lat": 0, "lon": 0})
-            
-            # 마지막 지점 → 물류센터 상세 경로도 비활성화
-            # last_loc = path[-1]["location"]
-            # return_path = get_detailed_path_geometry(last_loc, depot)
-            # if return_path: geometry_list.extend(return_path)
-            
-            path.append({
-                "location": depot,
-                "lat": depot_coord["lat"], "lon": depot_coord["lon"],
-                "time": end_time, "load": 0
-            })
-            
-            if len(path) > 2:
-                # 시작 시간 계산 (첫 번째 노드의 시간)
-                start_time = solution.Min(time_dim.CumulVar(routing.Start(v_idx))) if len(path) > 0 else 0
-                routes.append({
-                    "internal_idx": v_idx, 
-                    "start_time": start_time,
-                    "start_time_formatted": f"{start_time // 60:02d}:{start_time % 60:02d}",
-                    "end_time": end_time,
-                    "end_time_formatted": f"{end_time // 60:02d}:{end_time % 60:02d}",
-                    "total_load": load, 
-                    "path": path
-                    # "geometry": geometry_list  # 상세 경로 응답 비활성화
-                })
-                
-    remaining = [orders[i] for i in range(len(orders)) if i not in fulfilled_indices]
-    return routes, remaining
+            stops = []
+            while not is_end(index):
+                stops.append((index_to_node(index), sol_min(cumul_var(index))))
+                index = sol_value(next_var(index))
+            # 주문을 하나도 방문하지 않은 차량(물류센터 → 물류센터)은 제외
+            if len(stops) > 1:
+                visits.append((v_idx, stops, sol_min(cumul_var(index))))
+    return visits
 
-@app.post("/optimize")
-def optimize(req: OptimizationRequest):
-    gas = solve_multitrip_vrp(req.orders, req.vehicles, "휘발유")
-    diesel = solve_multitrip_vrp(req.orders, req.vehicles, "등경유")
+# 🔹 OR-Tools 탐색은 GIL을 잡고 실행되므로 스레드로는 휘발유/등경유 배차가 겹치지 않음 → 프로세스 풀 사용
+#    (작업자 프로세스는 요청마다 새로 띄우지 않고 재사용, 첫 요청 시 생성)
+_SOLVE_POOL = None
+
+def _init_solve_worker():
+    # spawn으로 시작한 작업자는 모듈 import 시 load_data()가 실행되지만, 비어 있으면 한 번 더 시도
+    if not NODE_COORDS and not NAME_TO_IDX:
+        load_data()
+    # OR-Tools는 첫 배차 요청이 아닌 작업자 시작 시 로드 (모듈 캐시만 채우는 용도)
+    importlib.import_module("ortools.constraint_solver.pywrapcp")
+    # numba 커널은 첫 요청이 아닌 작업자 시작 시 컴파일 (cache=True라 두 번째 작업자부터는 디스크 캐시 사용)
+    if _fill_haversine_nb is not None:
+        _fill_haversine_nb(np.full((2, 2), -1, dtype=np.int32), np.zeros((2, 2)), np.ones(2, dtype=bool))
+        _haversine_minutes_nb(0.0, 0.0, 0.0, 0.0)
+
+def get_solve_pool():
+    global _SOLVE_POOL
+    if _SOLVE_POOL is None:
+        # fork는 서버의 다른 스레드가 잡고 있던 락을 그대로 복제할 수 있으므로 spawn 사용
+        _SOLVE_POOL = ProcessPoolExecutor(
+            max_workers=SOLVE_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=_init_solve_worker
+        )
+    return _SOLVE_POOL
+
+def _reset_solve_pool(broken_pool):
+    """
+    작업자가 비정상 종료(OOM, OR-Tools 크래시 등)되어 깨진 풀을 버림 → 다음 get_solve_pool()에서 새로 생성
+    (동시에 실패한 다른 요청이 이미 새 풀을 만들었으면 그대로 둠)
+    """
+    global _SOLVE_POOL
+    if _SOLVE_POOL is broken_pool:
+        _SOLVE_POOL = None
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+
+async def _solve_request(req: OptimizationRequest, verbose: bool):
+    # 🔹 깨진 풀은 새로 만들어 한 번만 재시도, 그래도 실패하면 503
+    for _ in range(2):
+        pool = get_solve_pool()
+        try:
+            return await _solve_on_pool(pool, req, verbose)
+        except BrokenProcessPool:
+            print("❌ 배차 작업자 프로세스 비정상 종료, 작업자 풀 재생성")
+            _reset_solve_pool(pool)
+    raise HTTPException(status_code=503, detail="배차 작업자 프로세스 오류, 잠시 후 다시 시도하세요")
+
+async def _solve_on_pool(pool, req: OptimizationRequest, verbose: bool):
+    gas_orders, altteul_orders, gas_excluded, gas_arr = req.orders_for(FUEL_GAS)
+    diesel_orders, _, diesel_excluded, diesel_arr = req.orders_for(FUEL_DIESEL)
+    # 휘발유/등경유 배차는 공유하는 변경 가능 상태가 없으므로 별도 프로세스에서 동시에 실행
+    # 🔹 결과는 이벤트 루프에서 await (기다리는 동안 서버 스레드풀 스레드를 붙잡지 않음)
+    loop = asyncio.get_running_loop()
+    gas, diesel = await asyncio.gather(
+        loop.run_in_executor(
+            pool, solve_multitrip_vrp, gas_orders, altteul_orders, req.vehicles_for(FUEL_GAS), FUEL_GAS, gas_excluded, gas_arr, verbose
+        ),
+        loop.run_in_executor(
+            pool, solve_multitrip_vrp, diesel_orders, [], req.vehicles_for(FUEL_DIESEL), FUEL_DIESEL, diesel_excluded, diesel_arr, verbose
+        ),
+    )
     return {"gasoline": gas, "diesel": diesel}
 
+# 🔹 내용이 같은 요청이 처리 중이면 새로 배차하지 않고 진행 중인 결과를 함께 기다림 (요청 본문 해시 → Task)
+_INFLIGHT = {}
+
+async def _solve_shared(req: OptimizationRequest, verbose: bool):
+    key = hashlib.blake2b(
+        orjson.dumps([req.model_dump(), verbose], option=orjson.OPT_SORT_KEYS), digest_size=16
+    ).digest()
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_solve_request(req, verbose))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda _: _INFLIGHT.pop(key, None))
+    # 한 요청자가 연결을 끊어도 같은 결과를 기다리는 다른 요청의 배차는 취소되지 않도록 shield
+    return await asyncio.shield(task)
+
+@app.post("/optimize")
+async def optimize(req: OptimizationRequest, verbose: bool = True):
+    # 🔹 jsonable_encoder를 거치지 않고 orjson으로 바로 직렬화 (Waypoint/numpy 정수도 그대로 처리)
+    return ORJSONResponse(await _solve_shared(req, verbose))
+
+@app.post("/optimize/batch")
+async def optimize_batch(reqs: List[OptimizationRequest], verbose: bool = True):
+    """
+    여러 배차 요청을 한 번에 받아 작업자 프로세스에서 동시에 처리, 요청 순서대로 결과 목록 반환
+    """
+    return ORJSONResponse(await asyncio.gather(*(_solve_shared(req, verbose) for req in reqs)))
+
 @app.get("/")
 def health():
     return {
         "status": "ok", 
-        "matrix_loaded": len(MATRIX_DATA) > 0, 
+        "matrix_loaded": len(NAME_TO_IDX) > 0, 
         "naver_api": bool(NAVER_ID)
     }